@@ -7,7 +7,22 @@
 #
 # Extended with an easy to use interface (Attribra) to edit attribra.ini without manual editing.
 #Copyright 2025 Vince Jansen <jansen.vince@gmail.com>
+import bisect
+import collections
+import enum
+import hashlib
+import io
+import itertools
+import json
+import marshal
+import operator
 import os
+import re
+import sys
+import threading
+import time
+import types
+import weakref
 
 import addonHandler
 addonHandler.initTranslation()
@@ -16,8 +31,13 @@ from addonHandler import getCodeAddon
 import api
 import appModuleHandler
 import braille
+import config
+import controlTypes
+import core
 import globalPluginHandler
 import globalVars
+import inputCore
+import textInfos
 import ui
 from logHandler import log
 
@@ -28,11 +48,1197 @@ import gui
 from gui import guiHelper, settingsDialogs
 import wx
 
-ATTRS = {}
-logTextInfo = False
+# NVDA configuration for options that are not per-application rules.
+CONF_SECTION = "attribra"
+if CONF_SECTION not in config.conf.spec:
+	config.conf.spec[CONF_SECTION] = {}
+# When enabled, dots are only added to the cells currently shown on the display.
+config.conf.spec[CONF_SECTION]["windowMarking"] = "boolean(default=False)"
+# When enabled, format fields fetched for a line are reused while the caret moves within it.
+config.conf.spec[CONF_SECTION]["cacheFormatting"] = "boolean(default=False)"
+# When enabled, the format fields of the lines around the caret line are fetched while the user reads.
+config.conf.spec[CONF_SECTION]["prefetchLines"] = "boolean(default=False)"
+
+
+def _isWindowMarking():
+	return bool(config.conf[CONF_SECTION]["windowMarking"])
+
+
+def _isCachingFormatting():
+	return bool(config.conf[CONF_SECTION]["cacheFormatting"])
+
+
+def _isPrefetchingLines():
+	return bool(config.conf[CONF_SECTION]["prefetchLines"])
+
+# Bits of rawTextTypeforms holding the Attribra match class (0 = no match).
+# These should not clash with liblouis constants.
+ATTRIBRA_TYPEFORM_SHIFT = 20
+ATTRIBRA_TYPEFORM_MASK = 0xFF << ATTRIBRA_TYPEFORM_SHIFT
+
+# Dots 7 and 8 as bits of an NVDA braille cell.
+DOT7 = 0x40
+DOT8 = 0x80
+# Dots added for rules without their own dot pattern.
+ATTRIBRA_DOTS = DOT7 | DOT8
+# One single-byte string per match class, for filling class masks.
+_CLASS_BYTES = tuple(bytes((cls,)) for cls in range(256))
+
+# Every compiled rule set gets a new version, so caches can detect rule changes cheaply.
+_ruleVersions = itertools.count(1)
+
+# Format field attributes NVDA itself reads when calculating the liblouis typeform.
+_NVDA_TYPEFORM_ATTRS = ("bold", "italic", "underline")
+# Distinguishes a missing attribute from one set to None in cache keys.
+_MISSING = object()
+
+# Document formatting settings NVDA needs switched on to report a format field attribute.
+_FORMAT_CONFIG_KEYS = {
+	"bold": "reportFontAttributes",
+	"italic": "reportFontAttributes",
+	"underline": "reportFontAttributes",
+	"strikethrough": "reportFontAttributes",
+	"hidden": "reportFontAttributes",
+	"text-position": "reportSuperscriptsAndSubscripts",
+	"color": "reportColor",
+	"background-color": "reportColor",
+	"font-name": "reportFontName",
+	"font-size": "reportFontSize",
+	"invalid-spelling": "reportSpellingErrors",
+	"invalid-grammar": "reportSpellingErrors",
+	"marked": "reportHighlight",
+	"style": "reportStyle",
+	"text-align": "reportAlignment",
+	"line-spacing": "reportLineSpacing",
+	"comment": "reportComments",
+	"revision-insertion": "reportRevisions",
+	"revision-deletion": "reportRevisions",
+}
+# Settings forced for attributes not listed above; this is what Attribra always enabled before.
+_DEFAULT_FORMAT_CONFIG_KEYS = ("reportFontAttributes", "reportColor", "reportSpellingErrors")
+
+
+class _LRUCache:
+	"""Small bounded least-recently-used mapping with hit/miss counters."""
+
+	def __init__(self, maxSize):
+		self.maxSize = maxSize
+		self.hits = 0
+		self.misses = 0
+		self._items = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self._items)
+
+	def get(self, key, default=None, isValid=None):
+		"""Return the cached value for key, raising TypeError for unhashable keys.
+
+		When isValid is given, a cached value it rejects is dropped and counted as a miss.
+		"""
+		try:
+			value = self._items[key]
+		except KeyError:
+			self.misses += 1
+			return default
+		if isValid is not None and not isValid(value):
+			del self._items[key]
+			self.misses += 1
+			return default
+		self._items.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		items = self._items
+		items[key] = value
+		items.move_to_end(key)
+		if len(items) > self.maxSize:
+			items.popitem(last=False)
+
+	def pop(self, key, default=None):
+		return self._items.pop(key, default)
+
+	def clear(self):
+		self._items.clear()
+
+	def stats(self):
+		total = self.hits + self.misses
+		rate = (100.0 * self.hits / total) if total else 0.0
+		return "%d hits, %d misses (%.1f%% hit rate), %d entries" % (self.hits, self.misses, rate, len(self._items))
+
+
+# Typed rule values in attribra.ini, compiled by _parseTypedRule:
+#   font-size = >=14         number comparison (<, <=, =, >=, >)
+#   color = ~red:60          colour within a distance of a named or rrggbb colour
+#   font-name = re:Consolas|Courier   case-insensitive regular expression
+# ConfigObj reads an unquoted # as the start of a comment and an unquoted , as a list separator,
+# so values containing either must be quoted: color = "~#ff0000", font-name = "re:^Cour.{1,3}$".
+# Hex colours may also be written without the #. The settings dialog quotes values itself.
+_NUMBER_RULE = re.compile(r"^(<=|>=|<|>|=)\s*(-?\d+(?:\.\d+)?)\s*(?:pt|px)?$", re.IGNORECASE)
+_COLOUR_RULE = re.compile(r"^~\s*(?:#?([0-9a-f]{6})|([a-z]+))\s*(?::\s*(\d+))?$", re.IGNORECASE)
+_PATTERN_PREFIX = "re:"
+_COMPARISONS = {
+	"<": operator.lt,
+	"<=": operator.le,
+	"=": operator.eq,
+	">=": operator.ge,
+	">": operator.gt,
+}
+_COLOUR_NAMES = {
+	"black": (0, 0, 0),
+	"white": (255, 255, 255),
+	"red": (255, 0, 0),
+	"green": (0, 128, 0),
+	"blue": (0, 0, 255),
+	"yellow": (255, 255, 0),
+	"orange": (255, 165, 0),
+	"purple": (128, 0, 128),
+	"grey": (128, 128, 128),
+	"gray": (128, 128, 128),
+}
+# Default maximum RGB distance for "~colour" rules without an explicit distance.
+_DEFAULT_COLOUR_DISTANCE = 80
+_FIELD_NUMBER = re.compile(r"^\s*(-?\d+(?:\.\d+)?)")
+_FIELD_COLOUR = re.compile(r"^\s*(?:#([0-9a-f]{6})|rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\))\s*$", re.IGNORECASE)
+
+
+def _parseTypedRule(text):
+	"""Parse a typed rule value into marshal-compatible state, or return None for other values."""
+	text = (text or "").strip()
+	if text.lower().startswith(_PATTERN_PREFIX):
+		pattern = text[len(_PATTERN_PREFIX):].strip()
+		try:
+			re.compile(pattern)
+		except re.error:
+			return None
+		return ("pattern", pattern) if pattern else None
+	m = _NUMBER_RULE.match(text)
+	if m:
+		return ("number", m.group(1), float(m.group(2)))
+	m = _COLOUR_RULE.match(text)
+	if m:
+		hexColour, name, distance = m.groups()
+		if hexColour:
+			rgb = tuple(int(hexColour[i:i + 2], 16) for i in (0, 2, 4))
+		elif name.lower() in _COLOUR_NAMES:
+			rgb = _COLOUR_NAMES[name.lower()]
+		else:
+			return None
+		distance = int(distance) if distance else _DEFAULT_COLOUR_DISTANCE
+		return ("colour", rgb, distance * distance)
+	return None
+
+
+def _looksLikeTypedRule(text):
+	"""Whether a value is written as a typed rule, valid or not."""
+	text = text.strip()
+	return text[:1] in ("~", "<", ">", "=") or text.lower().startswith(_PATTERN_PREFIX)
+
+
+def _fieldNumber(value):
+	"""Return the number at the start of a format field value such as 12, "12pt" or "10.5 pt"."""
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return value
+	if isinstance(value, str):
+		m = _FIELD_NUMBER.match(value)
+		if m:
+			return float(m.group(1))
+	return None
+
+
+def _fieldColour(value):
+	"""Return (red, green, blue) for a format field colour value, or None."""
+	# NVDA's colors.RGB is a named tuple of three ints.
+	if isinstance(value, tuple) and len(value) == 3:
+		return value
+	if isinstance(value, str):
+		m = _FIELD_COLOUR.match(value)
+		if m:
+			if m.group(1):
+				return tuple(int(m.group(1)[i:i + 2], 16) for i in (0, 2, 4))
+			return (int(m.group(2)), int(m.group(3)), int(m.group(4)))
+	return None
+
+
+class _TypedRule:
+	"""A compiled number, colour or pattern rule for one format field attribute."""
+
+	__slots__ = ("state", "_kind", "_compare", "_operand")
+
+	def __init__(self, state):
+		self.state = state
+		self._kind = state[0]
+		if self._kind == "number":
+			self._compare = _COMPARISONS[state[1]]
+			self._operand = state[2]
+		elif self._kind == "colour":
+			self._compare = None
+			self._operand = (state[1], state[2])
+		else:
+			self._compare = None
+			self._operand = re.compile(state[1], re.IGNORECASE)
+
+	def matches(self, value):
+		kind = self._kind
+		if kind == "number":
+			number = _fieldNumber(value)
+			return number is not None and self._compare(number, self._operand)
+		if kind == "colour":
+			rgb = _fieldColour(value)
+			if rgb is None:
+				return False
+			target, maxDistance = self._operand
+			try:
+				return sum((a - b) * (a - b) for a, b in zip(rgb, target)) <= maxDistance
+			except TypeError:
+				return False
+		return self._operand.search(str(value)) is not None
+
+
+# Any rule value may end with its own dot pattern and priority, e.g. "bold = 1@7",
+# "invalid-spelling = 1@8/2" or "font-size = >=14@78/1".
+# Where rules overlap, the one with the highest priority decides the dots (default priority 0).
+_MARK_PREFIX = "@"
+_MARK_SUFFIX = re.compile(r"\s*@\s*([78]{1,2})\s*(?:/\s*(-?\d+))?\s*$")
+_DEFAULT_MARK = (0, ATTRIBRA_DOTS)
+
+
+def _parseMark(text):
+	"""Split a rule value into (value text, mark suffix or "")."""
+	m = _MARK_SUFFIX.search(text)
+	if not m:
+		return text, ""
+	digits = "".join(sorted(set(m.group(1))))
+	priority = int(m.group(2)) if m.group(2) else 0
+	suffix = _MARK_PREFIX + digits + ("/%d" % priority if priority else "")
+	return text[:m.start()].strip(), suffix
+
+
+def _splitMark(values):
+	"""Split a value list into (values, (priority, dots)) using its mark suffix, if any."""
+	if values and isinstance(values[-1], str) and values[-1].startswith(_MARK_PREFIX):
+		m = _MARK_SUFFIX.match(values[-1])
+		if m:
+			dots = (DOT7 if "7" in m.group(1) else 0) | (DOT8 if "8" in m.group(1) else 0)
+			return values[:-1], (int(m.group(2) or 0), dots)
+		return values[:-1], _DEFAULT_MARK
+	return values, _DEFAULT_MARK
+
+
+def _assignClasses(marks):
+	"""Number the distinct (priority, dots) marks so that a higher class means a higher priority.
+
+	Returns ({mark: class}, dots table), where the 256-entry table maps every class to its dots.
+	"""
+	classes = {}
+	table = bytearray(256)
+	for cls, mark in enumerate(sorted(set(marks)), 1):
+		cls = min(cls, 255)
+		classes[mark] = cls
+		table[cls] = mark[1]
+	return classes, bytes(table)
+
+
+# Control field rules in attribra.ini, e.g. "role:link = 1", "role:heading:2 = 1",
+# "role:link:visited = 1" or "state:required = 1". Names are matched case-insensitively,
+# ignoring "-" and "_".
+_CONTROL_RULE_KINDS = ("role", "state")
+
+
+def _normalizeEnumName(name):
+	return name.replace("_", "").replace("-", "").strip().lower()
+
+
+_ROLE_NAMES = {_normalizeEnumName(role.name): role for role in controlTypes.Role}
+_STATE_NAMES = {_normalizeEnumName(state.name): state for state in controlTypes.State}
+
+
+def _isControlRule(attr):
+	return attr.split(":", 1)[0].strip().lower() in _CONTROL_RULE_KINDS
+
+
+def _parseControlRule(attr):
+	"""Parse a role:/state: rule name into (role name or None, level or None, state names), or None."""
+	parts = [part.strip() for part in attr.split(":")]
+	kind = parts[0].lower()
+	roleName = None
+	level = None
+	stateNames = []
+	if kind == "role" and len(parts) >= 2:
+		roleName = _normalizeEnumName(parts[1])
+		if roleName not in _ROLE_NAMES:
+			return None
+		extra = parts[2:]
+	elif kind == "state" and len(parts) >= 2:
+		extra = parts[1:]
+	else:
+		return None
+	for part in extra:
+		if part.isdigit():
+			level = int(part)
+			continue
+		stateName = _normalizeEnumName(part)
+		if stateName not in _STATE_NAMES:
+			return None
+		stateNames.append(stateName)
+	if roleName is None and not stateNames:
+		return None
+	return (roleName, level, tuple(stateNames))
+
+
+class _ControlRules:
+	"""Control field rules indexed by role.
+
+	Most control fields have a role without rules and are rejected with one dict lookup.
+	Rules that only name states apply to every role and are checked last.
+	"""
+
+	__slots__ = ("state", "_byRole", "_anyRole")
+
+	def __init__(self, state):
+		# state is a tuple of (_parseControlRule result, match class) pairs.
+		self.state = state
+		byRole = {}
+		anyRole = []
+		for (roleName, level, stateNames), cls in state:
+			required = frozenset(_STATE_NAMES[name] for name in stateNames)
+			if roleName is None:
+				anyRole.append((required, cls))
+			else:
+				byRole.setdefault(_ROLE_NAMES[roleName], []).append((level, required, cls))
+		self._byRole = {role: tuple(conditions) for role, conditions in byRole.items()}
+		self._anyRole = tuple(anyRole)
+
+	def __len__(self):
+		return len(self.state)
+
+	def matchClass(self, field):
+		"""Return the highest class of the rules matching a control field, 0 when none match."""
+		conditions = self._byRole.get(field.get("role"))
+		if conditions is None and not self._anyRole:
+			return 0
+		states = field.get("states") or ()
+		best = 0
+		if conditions:
+			for level, required, cls in conditions:
+				if cls <= best:
+					continue
+				if level is not None and _fieldNumber(field.get("level")) != level:
+					continue
+				if required and not required.issubset(states):
+					continue
+				best = cls
+		for required, cls in self._anyRole:
+			if cls > best and required.issubset(states):
+				best = cls
+		return best
+
+
+class _CompiledRules:
+	"""Immutable matcher compiled from one attribra.ini section.
+
+	The value lists produced by _parse_value_to_list are turned into hashed sets once,
+	when the configuration is loaded. Matching a format field then costs
+	O(number of attributes in the field) instead of scanning every value list.
+	Typed rules (numbers, colours, patterns) are compiled into _TypedRule objects,
+	and role:/state: rules into the controls index.
+	Every rule gets a match class ranking its dot pattern by priority;
+	dotTable maps a class to the dots it adds to a braille cell.
+	"""
+
+	__slots__ = (
+		"version",
+		"rules",
+		"keyAttrs",
+		"formatConfigKeys",
+		"controls",
+		"dotTable",
+		"_accepted",
+		"_matchMissing",
+		"_typed",
+		"_classes",
+		"_topClass",
+	)
+
+	def __init__(self, mapping):
+		# Read-only view of the rules this matcher was compiled from.
+		self.rules = types.MappingProxyType({attr: tuple(values) for attr, values in mapping.items()})
+		accepted = {}
+		matchMissing = []
+		typed = {}
+		controlStates = []
+		marks = {}
+		for attr, values in mapping.items():
+			values, mark = _splitMark(values)
+			if _isControlRule(attr):
+				controlState = _parseControlRule(attr)
+				if controlState is None:
+					log.debugWarning("Attribra: ignoring unknown control rule %s" % attr)
+				elif values and True in values:
+					controlStates.append((controlState, mark))
+				continue
+			marks[attr] = mark
+			typedState = _parseTypedRule(values[0]) if values and isinstance(values[0], str) else None
+			if typedState is not None:
+				typed[attr] = _TypedRule(typedState)
+				continue
+			if values and isinstance(values[0], str) and _looksLikeTypedRule(values[0]):
+				log.warning(
+					"Attribra: ignoring invalid rule %s = %s; in attribra.ini, values containing # or , must be quoted"
+					% (attr, values[0])
+				)
+				continue
+			valueSet = set()
+			for value in values:
+				try:
+					valueSet.add(value)
+				except TypeError:
+					continue
+			if not valueSet:
+				continue
+			accepted[attr] = frozenset(valueSet)
+			# Fields were always read with field.get(attr, False),
+			# so a rule accepting False also matches fields lacking the attribute.
+			if False in valueSet:
+				matchMissing.append(attr)
+		self._accepted = accepted
+		self._typed = typed
+		ruleAttrs = tuple(accepted) + tuple(typed)
+		markClasses, self.dotTable = _assignClasses(
+			[marks[attr] for attr in ruleAttrs] + [mark for _state, mark in controlStates]
+		)
+		self._classes = {attr: markClasses[marks[attr]] for attr in ruleAttrs}
+		self._topClass = max(markClasses.values(), default=0)
+		self.controls = _ControlRules(tuple((state, markClasses[mark]) for state, mark in controlStates))
+		# Absence checks need no value lookup, so they are tried first.
+		self._matchMissing = tuple(matchMissing)
+		# The only field attributes that influence the resulting typeform.
+		self.keyAttrs = tuple(dict.fromkeys(_NVDA_TYPEFORM_ATTRS + ruleAttrs))
+		# Document formatting settings these rules need; fetching anything else is wasted work.
+		formatConfigKeys = {}
+		for attr in ruleAttrs:
+			if attr in _FORMAT_CONFIG_KEYS:
+				formatConfigKeys[_FORMAT_CONFIG_KEYS[attr]] = True
+			else:
+				formatConfigKeys.update(dict.fromkeys(_DEFAULT_FORMAT_CONFIG_KEYS, True))
+		self.formatConfigKeys = tuple(formatConfigKeys)
+		self.version = next(_ruleVersions)
+
+	def getState(self):
+		"""Return the compiled rules as plain marshal-compatible data."""
+		typed = {attr: rule.state for attr, rule in self._typed.items()}
+		return (
+			dict(self.rules),
+			dict(self._accepted),
+			typed,
+			self.controls.state,
+			self._classes,
+			self.dotTable,
+			self._matchMissing,
+			self.keyAttrs,
+			self.formatConfigKeys,
+		)
+
+	@classmethod
+	def fromState(cls, state):
+		"""Recreate compiled rules from getState() output without parsing them again."""
+		self = cls.__new__(cls)
+		(
+			rules,
+			self._accepted,
+			typed,
+			controls,
+			self._classes,
+			self.dotTable,
+			self._matchMissing,
+			self.keyAttrs,
+			self.formatConfigKeys,
+		) = state
+		self._typed = {attr: _TypedRule(typedState) for attr, typedState in typed.items()}
+		self.controls = _ControlRules(controls)
+		self._topClass = max(list(self._classes.values()) + [cls for _state, cls in controls], default=0)
+		self.rules = types.MappingProxyType(rules)
+		self.version = next(_ruleVersions)
+		return self
+
+	def __len__(self):
+		"""Number of format field rules; control rules are counted by len(self.controls)."""
+		return len(self._accepted) + len(self._typed)
+
+	def matchClass(self, field):
+		"""Return the highest class of the rules matching a format field, 0 when none match.
+
+		Matching stops as soon as a rule of the highest class has matched,
+		so with a single dot pattern this is as cheap as a yes/no match.
+		"""
+		classes = self._classes
+		top = self._topClass
+		best = 0
+		for attr in self._matchMissing:
+			if classes[attr] > best and attr not in field:
+				best = classes[attr]
+				if best == top:
+					return best
+		accepted = self._accepted
+		try:
+			if len(field) <= len(accepted):
+				for attr, fval in field.items():
+					valueSet = accepted.get(attr)
+					if valueSet is not None and classes[attr] > best and fval in valueSet:
+						best = classes[attr]
+						if best == top:
+							return best
+			else:
+				for attr, valueSet in accepted.items():
+					if classes[attr] > best and attr in field and field[attr] in valueSet:
+						best = classes[attr]
+						if best == top:
+							return best
+		except TypeError:
+			# Unhashable field values can never equal a configured value.
+			best = self._matchClassUnhashable(field, best)
+		for attr, rule in self._typed.items():
+			if classes[attr] <= best:
+				continue
+			value = field.get(attr)
+			if value is not None and rule.matches(value):
+				best = classes[attr]
+		return best
 
-# Internal marker bit used in rawTextTypeforms. This should not clash with liblouis constants.
-ATTRIBRA_TYPEFORM_MARKER = 1 << 20
+	def _matchClassUnhashable(self, field, best):
+		for attr, valueSet in self._accepted.items():
+			try:
+				if self._classes[attr] > best and attr in field and field[attr] in valueSet:
+					best = self._classes[attr]
+			except TypeError:
+				continue
+		return best
+
+
+_EMPTY_RULES = _CompiledRules({})
+
+
+# Rule value that switches an inherited global rule off in an application section: bold = off.
+# bold = 0 can't do that, as it marks text that is not bold.
+_OFF_VALUE = "off"
+
+
+def _isOffRule(values):
+	"""Whether a value list is the "off" override (see _OFF_VALUE)."""
+	values = _splitMark(values)[0]
+	return bool(values) and isinstance(values[0], str) and values[0].strip().lower() == _OFF_VALUE
+
+
+def _inheritedRules(configs, section):
+	"""Return the global rules that apply to section without being overridden by it."""
+	if section == "global":
+		return {}
+	mapping = configs.get(section, {})
+	return {
+		attr: values for attr, values in configs.get("global", {}).items()
+		if attr not in mapping and not _isOffRule(values)
+	}
+
+
+def _compileProfiles(configs):
+	"""Compile one merged rule profile per section.
+
+	Application sections inherit the global rules; an attribute present in both
+	uses the application's value, and "off" drops the attribute from the profile.
+	"""
+	profiles = {}
+	for section in set(configs) | {"global"}:
+		merged = dict(_inheritedRules(configs, section))
+		merged.update(
+			(attr, values) for attr, values in configs.get(section, {}).items() if not _isOffRule(values)
+		)
+		profiles[section] = _CompiledRules(merged)
+	return profiles
+
+# Compiled rules of the application that currently has focus.
+ATTRS = _EMPTY_RULES
+
+# Typeforms keyed by the projection of a format field onto ATTRS.keyAttrs.
+# Cleared whenever the active rules or the focused process change.
+_typeformCache = _LRUCache(512)
+_typeformCacheVersion = None
+
+
+def _formatConfigForRules(formatConfig, rules):
+	"""Return formatConfig with the settings needed by rules switched on.
+
+	formatConfig is returned unchanged, without copying it, when the user's own
+	settings already cover the rules.
+	"""
+	for key in rules.formatConfigKeys:
+		if not formatConfig.get(key):
+			break
+	else:
+		return formatConfig
+	conf = formatConfig.copy()
+	for key in rules.formatConfigKeys:
+		conf[key] = True
+	return conf
+
+
+def _recordMarkedSpans(region, commands, spans, controls, trace=None):
+	"""Pass NVDA's text/field commands through, recording marked raw text as (start, end) runs.
+
+	Runs are recorded as (start, end, match class). The class of a string is the highest of
+	its format field's class (region._attribraMarking) and those of the control fields
+	matched by controls that enclose it.
+	Each command is processed by NVDA before the next one is requested,
+	so after a string has been yielded it is already at the end of region.rawText.
+	Adjacent runs of one class are merged, so spans grows with the number of format runs, not characters.
+	When trace is a list, every string and control field is also appended to it
+	as (kind, start, end, field, class) for _FieldTrace.
+	"""
+	# One entry per open control field: the highest class of it and its ancestors.
+	openControls = []
+	formatField = None
+	for command in commands:
+		yield command
+		if isinstance(command, str):
+			cls = region._attribraMarking
+			if openControls and openControls[-1] > cls:
+				cls = openControls[-1]
+			if not command or not (cls or trace is not None):
+				continue
+			rawText = region.rawText
+			if not rawText.endswith(command):
+				continue
+			end = len(rawText)
+			start = end - len(command)
+			if trace is not None:
+				trace.append(("format", start, end, formatField, cls))
+				if not cls:
+					continue
+			if spans and spans[-1][1] == start and spans[-1][2] == cls:
+				spans[-1] = (spans[-1][0], end, cls)
+			else:
+				spans.append((start, end, cls))
+		elif (controls or trace is not None) and isinstance(command, textInfos.FieldCommand):
+			if command.command == "formatChange":
+				formatField = command.field
+			elif command.command == "controlStart":
+				cls = controls.matchClass(command.field) if controls else 0
+				openControls.append(max(cls, openControls[-1]) if openControls else cls)
+				if trace is not None:
+					offset = len(region.rawText)
+					trace.append(("control", offset, offset, command.field, cls))
+			elif command.command == "controlEnd" and openControls:
+				openControls.pop()
+
+
+def _compactTraceValue(value):
+	"""Return a JSON-compatible, length-limited form of a format or control field value."""
+	if isinstance(value, enum.Enum):
+		return value.name
+	if value is None or isinstance(value, (bool, int, float)):
+		return value
+	if isinstance(value, (set, frozenset)):
+		return sorted((_compactTraceValue(item) for item in value), key=str)
+	if isinstance(value, tuple) and all(isinstance(item, (int, float)) for item in value):
+		return list(value)
+	if not isinstance(value, str):
+		value = repr(value)
+	return value[:_FieldTrace.MAX_VALUE_LENGTH]
+
+
+class _FieldTrace:
+	"""Bounded in-memory trace of the fields Attribra saw while building braille regions.
+
+	Records are made from the commands NVDA already fetched for a region, so tracing
+	costs no extra TextInfo calls. A region rebuilt with unchanged text and marks is
+	not traced again, at most MAX_PER_SECOND records are taken per second, and the
+	oldest records drop out once MAX_RECORDS are kept.
+	"""
+
+	MAX_RECORDS = 256
+	MAX_PER_SECOND = 10
+	# Longest text kept for the region text and for string field values.
+	MAX_VALUE_LENGTH = 80
+
+	def __init__(self):
+		self.enabled = False
+		# Records skipped by the rate limit.
+		self.dropped = 0
+		self._records = collections.deque(maxlen=self.MAX_RECORDS)
+		self._lastDigests = weakref.WeakKeyDictionary()
+		self._second = 0
+		self._inSecond = 0
+
+	def __len__(self):
+		return len(self._records)
+
+	def clear(self):
+		self._records.clear()
+		self._lastDigests.clear()
+		self.dropped = 0
+
+	def snapshot(self):
+		return list(self._records)
+
+	def record(self, region, rules, trace, spans):
+		"""Add a record for a region build, given the trace list filled by _recordMarkedSpans."""
+		rawText = region.rawText
+		digest = (rules.version, hash(rawText), tuple(spans), len(trace))
+		if self._lastDigests.get(region) == digest:
+			return
+		now = time.monotonic()
+		if int(now) != self._second:
+			self._second = int(now)
+			self._inSecond = 0
+		if self._inSecond >= self.MAX_PER_SECOND:
+			self.dropped += 1
+			return
+		self._inSecond += 1
+		self._lastDigests[region] = digest
+		fields = []
+		fieldIndexes = {}
+		runs = []
+		controls = []
+		for kind, start, end, field, cls in trace:
+			index = fieldIndexes.get(id(field))
+			if index is None:
+				index = fieldIndexes[id(field)] = len(fields)
+				fields.append({str(key): _compactTraceValue(value) for key, value in (field or {}).items()})
+			if kind == "control":
+				controls.append([start, index, cls])
+			elif runs and runs[-1][1] == start and runs[-1][2:] == [index, cls]:
+				runs[-1][1] = end
+			else:
+				runs.append([start, end, index, cls])
+		self._records.append({
+			"time": round(time.time(), 3),
+			"rules": rules.version,
+			"length": len(rawText),
+			"text": rawText[:self.MAX_VALUE_LENGTH],
+			"fields": fields,
+			"runs": runs,
+			"controls": controls,
+		})
+
+
+# Toggled by GlobalPlugin.script_logFieldsAtCursor.
+_fieldTrace = _FieldTrace()
+
+
+def _spansToMask(spans, rawToBraillePos, cellCount, rawStart=0, rawEnd=None):
+	"""Translate raw text runs to braille positions and return a mask of match classes per cell.
+
+	When rawStart/rawEnd are given, the mask only covers the cells of that raw range.
+	Runs are clipped in braille positions, not raw positions, so the result is always
+	the matching slice of the mask for the whole region.
+	"""
+	rawCount = len(rawToBraillePos)
+	if rawEnd is None or rawEnd > rawCount:
+		rawEnd = rawCount
+	maskStart = rawToBraillePos[rawStart] if rawStart < rawCount else cellCount
+	maskEnd = rawToBraillePos[rawEnd] if rawEnd < rawCount else cellCount
+	mask = bytearray(max(maskEnd - maskStart, 0))
+	for start, end, cls in spans:
+		if start >= rawEnd:
+			# Braille positions never decrease, so no later run reaches the mask.
+			break
+		brailleStart = rawToBraillePos[start]
+		brailleEnd = rawToBraillePos[end] if end < rawCount else cellCount
+		if brailleEnd <= brailleStart:
+			# The whole run lies inside a contraction; mark at least its first cell.
+			brailleEnd = brailleStart + 1
+		brailleStart = max(brailleStart, maskStart) - maskStart
+		brailleEnd = min(brailleEnd, maskEnd) - maskStart
+		if brailleEnd > brailleStart:
+			mask[brailleStart:brailleEnd] = _CLASS_BYTES[cls] * (brailleEnd - brailleStart)
+	return mask
+
+
+def _commonPrefixLength(a, b):
+	"""Return the length of the common prefix of two sequences using slice comparisons."""
+	limit = min(len(a), len(b))
+	if a[:limit] == b[:limit]:
+		return limit
+	# Invariant: a[:low] == b[:low] and a[:high] != b[:high].
+	low, high = 0, limit
+	while high - low > 1:
+		mid = (low + high) // 2
+		if a[low:mid] == b[low:mid]:
+			low = mid
+		else:
+			high = mid
+	return low
+
+
+def _spansDivergence(oldSpans, newSpans):
+	"""Return the first raw position at which two run lists mark text differently, or None."""
+	for old, new in zip(oldSpans, newSpans):
+		if old != new:
+			if old[0] != new[0]:
+				return min(old[0], new[0])
+			if old[2] != new[2]:
+				# Another match class from the start of the run.
+				return old[0]
+			return min(old[1], new[1])
+	if len(oldSpans) == len(newSpans):
+		return None
+	longer = oldSpans if len(oldSpans) > len(newSpans) else newSpans
+	return longer[min(len(oldSpans), len(newSpans))][0]
+
+
+def _mirrorSpans(spans, count):
+	"""Return runs as offsets from the end of a text of the given length, last run first."""
+	return [(count - end, count - start, cls) for start, end, cls in reversed(spans)]
+
+
+def _incrementalMask(entry, rawText, spans, rawToBraillePos, cellCount):
+	"""Derive the class mask for an edited region from its previous class mask.
+
+	Only the cells of the changed raw range, widened to whole words because
+	contractions depend on their neighbours, are recomputed.
+	The unchanged head and tail are copied from the previous mask.
+	Returns None when the previous mask cannot be reused.
+	"""
+	oldText = entry.rawText
+	oldRawToBraille = entry.rawToBraillePos
+	oldCount, newCount = len(oldText), len(rawText)
+	if len(oldRawToBraille) != oldCount or len(rawToBraillePos) != newCount:
+		return None
+	head = _commonPrefixLength(oldText, rawText)
+	divergence = _spansDivergence(entry.spans, spans)
+	if divergence is not None:
+		head = min(head, divergence)
+	head = rawText.rfind(" ", 0, head) + 1
+	tail = _commonPrefixLength(oldText[::-1], rawText[::-1])
+	shift = newCount - oldCount
+	divergence = _spansDivergence(_mirrorSpans(entry.spans, oldCount), _mirrorSpans(spans, newCount))
+	if divergence is not None:
+		tail = min(tail, divergence)
+	tail = min(tail, newCount - head, oldCount - head)
+	boundary = rawText.find(" ", newCount - tail)
+	tail = newCount - boundary if boundary >= 0 else 0
+	tailStart = newCount - tail
+	oldMask = entry.classes
+	headCells = rawToBraillePos[head] if head < newCount else cellCount
+	oldHeadCells = oldRawToBraille[head] if head < oldCount else len(oldMask)
+	tailCells = cellCount - (rawToBraillePos[tailStart] if tailStart < newCount else cellCount)
+	oldTailCells = len(oldMask) - (oldRawToBraille[tailStart - shift] if tailStart - shift < oldCount else len(oldMask))
+	if headCells != oldHeadCells or tailCells != oldTailCells or headCells + tailCells > cellCount:
+		return None
+	return (
+		oldMask[:headCells]
+		+ _spansToMask(spans, rawToBraillePos, cellCount, head, tailStart)
+		+ oldMask[len(oldMask) - tailCells:]
+	)
+
+
+def _orMaskIntoCells(cells, mask):
+	"""OR a bytes mask into a list of braille cells in place.
+
+	Both buffers are combined as single big integers, so no per-cell Python branching is involved.
+	"""
+	count = min(len(cells), len(mask))
+	if not count:
+		return
+	mask = mask[:count]
+	if mask.count(0) == count:
+		return
+	merged = int.from_bytes(bytes(cells[:count]), "little") | int.from_bytes(mask, "little")
+	cells[:count] = merged.to_bytes(count, "little")
+
+
+# The match classes and dot mask computed for a region, with a digest of what they were computed from.
+# In window marking mode only the runs are kept; classes and mask are None
+# and GlobalPlugin._onPreWriteCells builds the mask for the visible cells with dotTable.
+_RegionMask = collections.namedtuple(
+	"_RegionMask", ("digest", "classes", "mask", "rawText", "spans", "rawToBraillePos", "dotTable")
+)
+# Last mask per region, reused when an update leaves text and marks unchanged
+# and read by window-scoped marking. Entries vanish with their regions.
+_regionMasks = weakref.WeakKeyDictionary()
+_windowMarking = False
+_cachingFormatting = False
+_prefetchingLines = False
+
+
+def _refreshOptions():
+	"""Read the options from the active configuration profile into module globals for the hooks."""
+	global _windowMarking, _cachingFormatting, _prefetchingLines
+	_windowMarking = _isWindowMarking()
+	_prefetchingLines = _isPrefetchingLines()
+	# Prefetched lines are handed to the hooks through the format field cache,
+	# so prefetching implies reusing formatting within a line; the settings dialog shows this.
+	_cachingFormatting = _isCachingFormatting() or _prefetchingLines
+	if not _prefetchingLines:
+		_linePrefetcher.cancel()
+	if not _cachingFormatting:
+		_fieldCache.clear()
+
+
+# Recent getTextWithFields results; see _cachedTextWithFields.
+# Entries are (object weakref, expiry time, commands).
+_fieldCache = _LRUCache(64)
+# Seconds a cached result is trusted; formatting can change without any event, e.g. Word's spell checker.
+_FIELD_CACHE_TTL = 2.0
+# Prefetched lines are usually read some time after they were fetched, and are not the line being edited.
+# They are kept under their own key and only get _FIELD_CACHE_TTL once the caret reaches them.
+_PREFETCH_TTL = 30.0
+# Results with more commands than this are not cached, which bounds the cache's memory use.
+_FIELD_CACHE_MAX_COMMANDS = 2000
+# Keys that only move the caret or selection; other key presses may change the document.
+_NAVIGATION_KEYS = frozenset((
+	"leftArrow",
+	"rightArrow",
+	"upArrow",
+	"downArrow",
+	"home",
+	"end",
+	"pageUp",
+	"pageDown",
+))
+
+
+def _rangeKey(info):
+	"""Return a hashable key for the document range of a TextInfo."""
+	bookmark = info.bookmark
+	# textInfos.offsets.Offsets compares by value but is not hashable.
+	startOffset = getattr(bookmark, "startOffset", None)
+	if startOffset is not None:
+		return (startOffset, bookmark.endOffset)
+	return bookmark
+
+
+def _fieldCacheKey(kind, info, formatConfig):
+	"""Return the _fieldCache key for a TextInfo's range, raising when it has no usable bookmark."""
+	key = (kind, id(info.obj), _rangeKey(info), frozenset(formatConfig.items()) if formatConfig else None)
+	hash(key)
+	return key
+
+
+def _getCachedFields(key, obj):
+	"""Return the cached commands for key, None for a line that cannot be cut into chunks, or _MISSING."""
+	now = time.monotonic()
+	entry = _fieldCache.get(key, isValid=lambda entry: entry[0]() is obj and now < entry[1])
+	return _MISSING if entry is None else entry[2]
+
+
+def _isSliceableLine(commands, length):
+	"""Whether a line's commands can be cut at character offsets: only text and format changes,
+	with the text exactly as long as the line's offset range."""
+	textLength = 0
+	for command in commands:
+		if isinstance(command, str):
+			textLength += len(command)
+		elif not (isinstance(command, textInfos.FieldCommand) and command.command == "formatChange"):
+			return False
+	return textLength == length
+
+
+def _fetchLine(lineInfo, formatConfig, kind, ttl):
+	"""Fetch the commands of a whole line into _fieldCache and return them, or None when they cannot be cut into chunks.
+
+	kind is "line" for the caret line and "prefetch" for lines fetched by _LinePrefetcher.
+	"""
+	key = _fieldCacheKey(kind, lineInfo, formatConfig)
+	lineStart, lineEnd = key[2]
+	commands = lineInfo.getTextWithFields(formatConfig=formatConfig)
+	if len(commands) > _FIELD_CACHE_MAX_COMMANDS or not _isSliceableLine(commands, lineEnd - lineStart):
+		commands = None
+	else:
+		commands = tuple(commands)
+	_fieldCache.put(key, (weakref.ref(lineInfo.obj), time.monotonic() + ttl, commands))
+	return commands
+
+
+def _takePrefetchedLine(lineKey, obj):
+	"""Move a prefetched line into the caret line cache with the normal lifetime and return its commands, or _MISSING."""
+	prefetchKey = ("prefetch",) + lineKey[1:]
+	commands = _getCachedFields(prefetchKey, obj)
+	if commands is not _MISSING:
+		_fieldCache.pop(prefetchKey)
+		_fieldCache.put(lineKey, (weakref.ref(obj), time.monotonic() + _FIELD_CACHE_TTL, commands))
+	return commands
+
+
+def _sliceLine(commands, start, end):
+	"""Return the commands for the text between start and end, offsets within a line accepted by _isSliceableLine.
+
+	The format change in effect at start is repeated before the first string.
+	"""
+	result = []
+	pos = 0
+	formatChange = None
+	for command in commands:
+		if not isinstance(command, str):
+			formatChange = command
+			continue
+		nextPos = pos + len(command)
+		if nextPos > start and pos < end:
+			if formatChange is not None:
+				result.append(formatChange)
+				formatChange = None
+			result.append(command[max(start - pos, 0):end - pos])
+		pos = nextPos
+		if pos >= end:
+			break
+	return result
+
+
+def _cachedTextWithFields(info, getTextWithFields, formatConfig, lineInfo=None):
+	"""Return getTextWithFields(formatConfig), reusing recent results for the same object, range and settings.
+
+	NVDA builds a caret region from up to three chunks of the line (before, at and after the caret),
+	so a chunk changes whenever the caret moves. When lineInfo is the region's whole line,
+	the line is fetched once, as a single call, and chunks are cut from it; this also picks up
+	lines fetched by _LinePrefetcher. Lines with control fields or offsets that do not match their
+	text are fetched chunk by chunk as before.
+	In Word and Outlook every such query is an out-of-process call.
+	"""
+	obj = info.obj
+	if lineInfo is not None and lineInfo is not info:
+		try:
+			lineKey = _fieldCacheKey("line", lineInfo, formatConfig)
+			chunkStart, chunkEnd = _rangeKey(info)
+			lineStart, lineEnd = lineKey[2]
+			inLine = lineInfo.obj is obj and lineStart <= chunkStart <= chunkEnd <= lineEnd
+		except Exception:
+			# Not an offset based TextInfo.
+			inLine = False
+		if inLine:
+			commands = _getCachedFields(lineKey, obj)
+			if commands is _MISSING:
+				commands = _takePrefetchedLine(lineKey, obj)
+			if commands is _MISSING:
+				commands = _fetchLine(lineInfo, formatConfig, "line", _FIELD_CACHE_TTL)
+			if commands is not None:
+				return _sliceLine(commands, chunkStart - lineStart, chunkEnd - lineStart)
+	try:
+		key = _fieldCacheKey("range", info, formatConfig)
+	except Exception:
+		# Some TextInfo implementations cannot produce a usable bookmark.
+		return getTextWithFields(formatConfig=formatConfig)
+	commands = _getCachedFields(key, obj)
+	if commands is not _MISSING:
+		return list(commands)
+	commands = getTextWithFields(formatConfig=formatConfig)
+	if len(commands) <= _FIELD_CACHE_MAX_COMMANDS:
+		_fieldCache.put(key, (weakref.ref(obj), time.monotonic() + _FIELD_CACHE_TTL, tuple(commands)))
+	return commands
+
+
+class _LinePrefetcher:
+	"""Fetches the lines before and after the caret line into _fieldCache while the user reads.
+
+	NVDA's TextInfos, like the COM objects behind Word and Outlook, may only be used
+	on the main thread, so the work is done there in short delayed callbacks,
+	one line per callback. At most MAX_QUEUED lines wait; moving to another line
+	or a focus change cancels what has not run yet.
+	"""
+
+	# Milliseconds to wait before fetching a queued line.
+	DELAY = 300
+	MAX_QUEUED = 2
+
+	def __init__(self):
+		self._queue = collections.deque()
+		self._timer = None
+		self._lastLine = None
+
+	def cancel(self):
+		self._queue.clear()
+		self._lastLine = None
+		if self._timer is not None:
+			self._timer.Stop()
+			self._timer = None
+
+	def schedule(self, region, formatConfig):
+		"""Queue the neighbours of a region's line, unless they were queued for this line already."""
+		lineInfo = getattr(region, "_readingInfo", None)
+		if lineInfo is None:
+			return
+		try:
+			line = (id(lineInfo.obj), _rangeKey(lineInfo))
+			hash(line)
+		except Exception:
+			return
+		if line == self._lastLine:
+			# The caret moved within the line.
+			return
+		self.cancel()
+		self._lastLine = line
+		unit = region._getReadingUnit()
+		for direction in (1, -1):
+			self._queue.append((lineInfo.copy(), unit, direction, formatConfig))
+		while len(self._queue) > self.MAX_QUEUED:
+			self._queue.popleft()
+		self._timer = core.callLater(self.DELAY, self._run)
+
+	def _run(self):
+		self._timer = None
+		if not self._queue:
+			return
+		lineInfo, unit, direction, formatConfig = self._queue.popleft()
+		try:
+			info = lineInfo.copy()
+			info.collapse()
+			if info.move(unit, direction):
+				info.expand(unit)
+				key = _fieldCacheKey("line", info, formatConfig)
+				if (
+					_getCachedFields(key, info.obj) is _MISSING
+					and _getCachedFields(("prefetch",) + key[1:], info.obj) is _MISSING
+				):
+					_fetchLine(info, formatConfig, "prefetch", _PREFETCH_TTL)
+		except Exception:
+			log.debugWarning("Attribra: could not prefetch a line", exc_info=True)
+		if self._queue:
+			self._timer = core.callLater(self.DELAY, self._run)
+
+
+_linePrefetcher = _LinePrefetcher()
+
+
+def _onExecuteGesture(gesture):
+	"""Forget cached format fields before a key press that may edit the document."""
+	if _fieldCache:
+		keyName = getattr(gesture, "mainKeyName", None)
+		if keyName is not None and keyName not in _NAVIGATION_KEYS:
+			_fieldCache.clear()
+	return True
+
+
+def _refreshMarkedRegions():
+	"""Re-render the braille regions whose Attribra marks are out of date.
+
+	Only text regions carry Attribra marks, and only those whose stored mask was
+	computed with other rules than the active ones are updated,
+	one region update each instead of rebuilding the whole braille buffer.
+	"""
+	handler = braille.handler
+	if not handler:
+		return
+	buf = handler.mainBuffer
+	stale = []
+	for region in buf.visibleRegions:
+		if not isinstance(region, braille.TextInfoRegion):
+			continue
+		entry = _regionMasks.get(region)
+		if entry is None or entry.digest[0] != ATTRS.version:
+			stale.append(region)
+	if not stale:
+		return
+	buf.saveWindow()
+	for region in stale:
+		region.update()
+	buf.update()
+	buf.restoreWindow()
+	if handler.buffer is buf:
+		handler.update()
+
+
+def _clearTypeformCache():
+	global _typeformCacheVersion
+	_typeformCache.clear()
+	_typeformCacheVersion = None
 
 
 def _parse_value_to_list(value):
@@ -47,68 +1253,297 @@ def _parse_value_to_list(value):
 		value = value[0] if value else ""
 	if value is None:
 		value = ""
-	v = str(value).strip()
+	v, mark = _parseMark(str(value).strip())
+	# A dot pattern/priority suffix (see _parseMark) is kept as the last item.
+	marks = [mark] if mark else []
 	if v in ("0", "1"):
 		i = int(v)
 		b = bool(i)
 		# Include string, int and bool representations.
-		return [v, i, b]
-	# Any unexpected value is kept as-is (it simply won't match boolean fields).
-	return [v]
+		return [v, i, b] + marks
+	# Any other value is kept as-is: typed rules (see _parseTypedRule) are compiled from it,
+	# anything else simply won't match boolean fields.
+	return [v] + marks
 
 
 def _list_to_ini_value(values):
 	"""Convert the internal list back to a single ini string for storage.
-	We store a single '0' or '1'.
+	We store a single '0' or '1', or the text of a typed rule, followed by the dot pattern suffix if any.
 	"""
 	if not values:
 		return ""
+	mark = ""
+	if len(values) > 1 and isinstance(values[-1], str) and values[-1].startswith(_MARK_PREFIX):
+		values, mark = values[:-1], values[-1]
 	# Prefer an int/bool if present.
 	for v in values:
 		if isinstance(v, bool):
-			return "1" if v else "0"
+			return ("1" if v else "0") + mark
 		if isinstance(v, int) and v in (0, 1):
-			return str(v)
+			return str(v) + mark
 	# Fallback to string.
-	v0 = str(values[0]).strip()
-	if v0 in ("0", "1"):
-		return v0
-	return v0
+	v0 = str(values[0]).strip() if values else ""
+	return v0 + mark
+
+
+def _readConfigFile(path):
+	"""Parse attribra.ini into {section: {attribute: value list}}. Safe to call from any thread.
+
+	Returns (configs, source), where source is the (signature, content) that was parsed,
+	to be handed to _saveRuleCache.
+	"""
+	# Stat before reading: if the file changes in between, the recorded signature is stale
+	# and the cache falls back to comparing the content hash, which matches what was parsed.
+	signature = _fileSignature(path)
+	with open(path, "rb") as f:
+		content = f.read()
+	configs = {}
+	for app, mapping in ConfigObj(io.BytesIO(content), encoding="UTF-8").items():
+		section = configs[app] = {}
+		for name, value in mapping.items():
+			if isinstance(value, list):
+				log.warning(
+					"Attribra: [%s] %s has an unquoted comma, only %r is used; quote the value in attribra.ini"
+					% (app, name, value[0] if value else "")
+				)
+			section[name] = _parse_value_to_list(value)
+	return configs, (signature, content)
+
+
+# Bump when the layout of _CompiledRules.getState() changes.
+_RULE_CACHE_FORMAT = 5
+
+
+def _ruleCachePath(configFile):
+	return os.path.splitext(configFile)[0] + ".cache"
+
+
+def _loadRuleCache(configFile):
+	"""Return (configs, profiles) from the compiled rule cache next to configFile.
+
+	The cache is used when attribra.ini still has the recorded mtime and size,
+	or otherwise the recorded content hash. Returns None when it is missing or stale.
+	"""
+	signature = _fileSignature(configFile)
+	if signature is None:
+		return None
+	try:
+		with open(_ruleCachePath(configFile), "rb") as f:
+			data = marshal.load(f)
+		if data["format"] != (_RULE_CACHE_FORMAT, tuple(sys.version_info[:2])):
+			return None
+		if data["signature"] != signature:
+			with open(configFile, "rb") as f:
+				if hashlib.sha256(f.read()).hexdigest() != data["hash"]:
+					return None
+		configs = data["configs"]
+		profiles = {section: _CompiledRules.fromState(state) for section, state in data["profiles"].items()}
+	except (OSError, EOFError, ValueError, TypeError, KeyError):
+		return None
+	return configs, profiles
+
+
+# Serializes writes of the rule cache, which happen on the watcher and save threads.
+_ruleCacheLock = threading.Lock()
+
+
+def _saveRuleCache(configFile, source, configs, profiles):
+	"""Store normalized configs and compiled profiles next to configFile (best effort).
+
+	source is the (signature, content) of attribra.ini the configs were parsed from
+	or written as, so the cache never vouches for a file that changed afterwards.
+	"""
+	signature, content = source
+	cachePath = _ruleCachePath(configFile)
+	try:
+		data = {
+			"format": (_RULE_CACHE_FORMAT, tuple(sys.version_info[:2])),
+			"signature": signature,
+			"hash": hashlib.sha256(content).hexdigest(),
+			"configs": configs,
+			"profiles": {section: profile.getState() for section, profile in profiles.items()},
+		}
+		tempPath = cachePath + ".tmp"
+		with _ruleCacheLock:
+			with open(tempPath, "wb") as f:
+				marshal.dump(data, f)
+			os.replace(tempPath, cachePath)
+	except (OSError, ValueError):
+		log.debugWarning("Could not write the Attribra rule cache", exc_info=True)
+
+
+def _fileSignature(path):
+	"""Return (mtime, size) of a file, or None when it does not exist."""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime_ns, st.st_size)
+
+
+class _ConfigWatcher:
+	"""Watches attribra.ini for changes made outside the settings dialog.
+
+	The file is polled by mtime and size on a background thread. A change is only
+	acted upon once the file has stayed the same for a whole poll interval,
+	so a burst of writes results in a single reload. Parsing and compiling happen
+	on the worker thread; the result is handed to onLoaded on the main thread.
+	"""
+
+	POLL_INTERVAL = 1.0
+
+	def __init__(self, path, onLoaded):
+		self._path = path
+		self._onLoaded = onLoaded
+		self._known = _fileSignature(path)
+		self._stopEvent = threading.Event()
+		self._thread = threading.Thread(target=self._run, name="AttribraConfigWatcher", daemon=True)
+
+	def start(self):
+		self._thread.start()
+
+	def stop(self):
+		self._stopEvent.set()
+		self._thread.join(self.POLL_INTERVAL * 2)
+
+	def markCurrent(self):
+		"""Treat the file as it is now as already loaded, e.g. after saving it ourselves."""
+		self._known = _fileSignature(self._path)
+
+	def _run(self):
+		pending = None
+		while not self._stopEvent.wait(self.POLL_INTERVAL):
+			signature = _fileSignature(self._path)
+			if signature is None or signature == self._known:
+				pending = None
+				continue
+			if signature != pending:
+				# Still being written, or just changed; wait until it settles.
+				pending = signature
+				continue
+			pending = None
+			self._known = signature
+			try:
+				configs, source = _readConfigFile(self._path)
+				profiles = _compileProfiles(configs)
+			except Exception:
+				log.exception("Error reloading attribra.ini")
+				continue
+			_saveRuleCache(self._path, source, configs, profiles)
+			log.debug("Attribra: attribra.ini changed on disk, reloading")
+			wx.CallAfter(self._onLoaded, configs, profiles)
 
 
 def decorator(fn, which):
 	def _getTypeformFromFormatField(self, field, formatConfig):
-		# Start with NVDA's default typeform calculation.
-		base = fn(self, field, formatConfig)
-		# If any configured attribute matches, set our marker bit.
-		for attr, value in ATTRS.items():
-			fval = field.get(attr, False)
-			if fval in value:
-				return base | ATTRIBRA_TYPEFORM_MARKER
-		return base
+		global _typeformCacheVersion
+		rules = ATTRS
+		if _typeformCacheVersion != rules.version:
+			_typeformCache.clear()
+			_typeformCacheVersion = rules.version
+		key = (
+			formatConfig.get("reportFontAttributes"),
+			formatConfig.get("fontAttributeReporting"),
+		) + tuple([field.get(attr, _MISSING) for attr in rules.keyAttrs])
+		try:
+			typeform = _typeformCache.get(key)
+		except TypeError:
+			# Unhashable attribute values; compute without caching.
+			key = None
+			typeform = None
+		if typeform is None:
+			# Start with NVDA's default typeform calculation.
+			typeform = fn(self, field, formatConfig)
+			# Store the class of the best matching rule in our typeform bits.
+			if rules:
+				typeform |= rules.matchClass(field) << ATTRIBRA_TYPEFORM_SHIFT
+			if key is not None:
+				_typeformCache.put(key, typeform)
+		# Read by _recordMarkedSpans for the text following this field.
+		self._attribraMarking = (typeform & ATTRIBRA_TYPEFORM_MASK) >> ATTRIBRA_TYPEFORM_SHIFT
+		return typeform
 
 	def addTextWithFields_edit(self, info, formatConfig, isSelection=False):
-		conf = formatConfig.copy()
-		conf["reportFontAttributes"] = True
-		conf["reportColor"] = True
-		conf["reportSpellingErrors"] = True
-		if logTextInfo:
-			log.info(info.getTextWithFields(conf))
-		fn(self, info, conf, isSelection)
+		conf = _formatConfigForRules(formatConfig, ATTRS)
+		spans = getattr(self, "_attribraSpans", None)
+		if spans is None:
+			# Not called from our update(); there is nothing to record spans for.
+			fn(self, info, conf, isSelection)
+			return
+		self._attribraMarking = 0
+		getTextWithFields = info.getTextWithFields
+		if _cachingFormatting:
+			self._attribraConf = conf
+			lineInfo = getattr(self, "_readingInfo", None)
+			fetch = lambda formatConfig: _cachedTextWithFields(info, getTextWithFields, formatConfig, lineInfo)
+		else:
+			fetch = lambda formatConfig: getTextWithFields(formatConfig=formatConfig)
+		# Shadow the method on this TextInfo instance only, for the duration of NVDA's call.
+		controls = ATTRS.controls
+		trace = self._attribraTrace
+		info.getTextWithFields = lambda formatConfig=None: _recordMarkedSpans(
+			self,
+			fetch(formatConfig),
+			spans,
+			controls,
+			trace,
+		)
+		try:
+			fn(self, info, conf, isSelection)
+		finally:
+			del info.getTextWithFields
 
 	def update(self):
-		fn(self)
-		DOT7 = 64
-		DOT8 = 128
-		# rawTextTypeforms entries can contain multiple liblouis flags ORed together.
-		# We use a dedicated marker bit to decide where dots 7 and 8 should be applied.
-		for i in range(0, len(self.rawTextTypeforms)):
-			try:
-				tf = self.rawTextTypeforms[i]
-			except Exception:
-				continue
-			if tf & ATTRIBRA_TYPEFORM_MARKER:
-				self.brailleCells[i] |= DOT7 | DOT8
+		# Marked raw text runs, filled in by addTextWithFields_edit while NVDA builds the region.
+		self._attribraSpans = spans = []
+		self._attribraTrace = trace = [] if _fieldTrace.enabled else None
+		try:
+			fn(self)
+		finally:
+			self._attribraSpans = None
+			self._attribraTrace = None
+		if trace is not None:
+			_fieldTrace.record(self, ATTRS, trace, spans)
+		if _prefetchingLines and getattr(self, "_attribraConf", None) is not None:
+			_linePrefetcher.schedule(self, self._attribraConf)
+		if not spans:
+			_regionMasks.pop(self, None)
+			return
+		rules = ATTRS
+		cells = self.brailleCells
+		rawText = self.rawText
+		rawToBraillePos = self.rawToBraillePos
+		digest = (rules.version, len(cells), len(rawText), hash(rawText), tuple(spans))
+		if _windowMarking:
+			# GlobalPlugin._onPreWriteCells marks the visible cells from the runs; no mask for the whole region.
+			_regionMasks[self] = _RegionMask(digest, None, None, rawText, spans, rawToBraillePos, rules.dotTable)
+			return
+		entry = _regionMasks.get(self)
+		if entry is not None and entry.mask is None:
+			# Stored in window marking mode.
+			entry = None
+		if entry is not None and entry.digest == digest and entry.rawToBraillePos == rawToBraillePos:
+			# Typically a caret-only update: same text, same marks.
+			# The mapping is compared too: with expandAtCursor, moving the caret to another word
+			# changes which word is contracted without changing the text or the cell count.
+			mask = entry.mask
+		else:
+			classes = None
+			if entry is not None and entry.digest[0] == digest[0]:
+				# Typically an edit: only the changed part of the region needs new marks.
+				classes = _incrementalMask(entry, rawText, spans, rawToBraillePos, len(cells))
+				if classes is not None and _fieldTrace.enabled:
+					# While diagnosing, check the incremental result against a full rebuild.
+					fullClasses = _spansToMask(spans, rawToBraillePos, len(cells))
+					if classes != fullClasses:
+						log.debugWarning("Attribra: incremental mask differs from a full rebuild for %r" % rawText)
+						classes = fullClasses
+			if classes is None:
+				classes = _spansToMask(spans, rawToBraillePos, len(cells))
+			# One table lookup per cell turns match classes into dots, whatever the number of dot patterns.
+			mask = classes.translate(rules.dotTable)
+			_regionMasks[self] = _RegionMask(digest, classes, mask, rawText, spans, rawToBraillePos, rules.dotTable)
+		_orMaskIntoCells(cells, mask)
 
 	if which == "addTextWithFields":
 		return addTextWithFields_edit
@@ -121,6 +1556,17 @@ def decorator(fn, which):
 class AttribraRuleDialog(wx.Dialog):
 	"""Dialog to add/edit one rule: attribute + values."""
 
+	# Rule kinds offered in the dialog, matching the states returned by _parseTypedRule.
+	# The prefix is added to the condition text when storing the rule.
+	_RULE_KINDS = (
+		(None, ""),
+		("number", ""),
+		("colour", "~"),
+		("pattern", _PATTERN_PREFIX),
+	)
+	# Dot patterns offered in the dialog, as stored in the mark suffix ("" = default, dots 7 and 8).
+	_DOT_PATTERNS = ("", "7", "8")
+
 	def __init__(self, parent, title, attrName="", valuesText=""):
 		super().__init__(parent, title=title)
 		self.attrName = attrName
@@ -133,29 +1579,116 @@ class AttribraRuleDialog(wx.Dialog):
 		self.attrCtrl = sHelper.addLabeledControl(_("Attribute name"), wx.TextCtrl)
 		self.attrCtrl.SetValue(attrName)
 
+		# Translators: Label for the choice of the kind of Attribra rule.
+		self.kindCtrl = sHelper.addLabeledControl(
+			_("Rule type"),
+			wx.Choice,
+			choices=[
+				# Translators: A kind of Attribra rule: the attribute is on or off, such as bold.
+				_("On/off"),
+				# Translators: A kind of Attribra rule: the attribute is compared with a number, such as a font size.
+				_("Number comparison"),
+				# Translators: A kind of Attribra rule: the attribute is a colour close to a given colour.
+				_("Colour"),
+				# Translators: A kind of Attribra rule: the attribute matches a text pattern, such as a font name.
+				_("Text pattern"),
+			],
+		)
+		self.kindCtrl.Bind(wx.EVT_CHOICE, self._onKindChanged)
+
 		# Translators: Label for the choice field that sets a rule value (0 = off, 1 = on).
 		self.valCtrl = sHelper.addLabeledControl(
 			_("Value (0 = off, 1 = on)"),
 			wx.Choice,
 			choices=["0", "1"],
 		)
-		# Normalize existing value to 0/1
+		# Translators: Label for the condition of a typed Attribra rule.
+		# Examples: ">=14" for a number, "red:60" or "#ff0000" for a colour, "Consolas|Courier" for a text pattern.
+		self.conditionCtrl = sHelper.addLabeledControl(_("Condition (e.g. >=14, red:60, Consolas|Courier)"), wx.TextCtrl)
+
+		# Translators: Label for the choice of braille dots used to mark text matching an Attribra rule.
+		self.dotsCtrl = sHelper.addLabeledControl(
+			_("Braille dots"),
+			wx.Choice,
+			choices=[
+				# Translators: Text matching an Attribra rule is marked with dots 7 and 8.
+				_("Dots 7 and 8"),
+				# Translators: Text matching an Attribra rule is marked with dot 7.
+				_("Dot 7"),
+				# Translators: Text matching an Attribra rule is marked with dot 8.
+				_("Dot 8"),
+			],
+		)
+		# Translators: Label for the priority of an Attribra rule; where rules overlap, the highest priority decides the dots.
+		self.priorityCtrl = sHelper.addLabeledControl(_("Priority"), wx.SpinCtrl, min=-99, max=99, initial=0)
+
 		v = (valuesText or "").strip()
 		if "," in v:
 			v = v.split(",", 1)[0].strip()
+		v, mark = _parseMark(v)
+		_values, (priority, dots) = _splitMark([mark] if mark else [])
+		dotsText = "" if dots == ATTRIBRA_DOTS else ("7" if dots == DOT7 else "8")
+		self.dotsCtrl.SetSelection(self._DOT_PATTERNS.index(dotsText))
+		self.priorityCtrl.SetValue(priority)
+		typedState = _parseTypedRule(v)
+		kindIndex = 0
+		if typedState is not None:
+			kindIndex = next(i for i, (kind, _prefix) in enumerate(self._RULE_KINDS) if kind == typedState[0])
+			prefix = self._RULE_KINDS[kindIndex][1]
+			self.conditionCtrl.SetValue(v[len(prefix):].strip())
+			v = "1"
+		# Normalize existing value to 0/1
 		if v not in ("0", "1"):
 			v = "0"
 		self.valCtrl.SetSelection(0 if v == "0" else 1)
+		self.kindCtrl.SetSelection(kindIndex)
+		self._updateValueControls()
 
 		mainSizer.Add(sHelper.sizer, border=guiHelper.BORDER_FOR_DIALOGS, flag=wx.ALL | wx.EXPAND)
 
 		btns = self.CreateButtonSizer(wx.OK | wx.CANCEL)
 		mainSizer.Add(btns, border=guiHelper.BORDER_FOR_DIALOGS, flag=wx.ALL | wx.EXPAND)
+		self.Bind(wx.EVT_BUTTON, self._onOk, id=wx.ID_OK)
 
 		self.SetSizerAndFit(mainSizer)
 
+	def _onKindChanged(self, evt):
+		self._updateValueControls()
+
+	def _updateValueControls(self):
+		isTyped = self.kindCtrl.GetSelection() > 0
+		self.valCtrl.Enable(not isTyped)
+		self.conditionCtrl.Enable(isTyped)
+
+	def _onOk(self, evt):
+		if self.kindCtrl.GetSelection() > 0 and _parseTypedRule(_parseMark(self.getData()[1])[0]) is None:
+			wx.MessageBox(
+				# Translators: Error shown when the condition of a typed Attribra rule cannot be understood.
+				_("The condition is not valid for this rule type."),
+				# Translators: Title of an error message box.
+				_("Error"),
+				wx.OK | wx.ICON_ERROR,
+				self,
+			)
+			self.conditionCtrl.SetFocus()
+			return
+		evt.Skip()
+
 	def getData(self):
-		return self.attrCtrl.GetValue().strip(), self.valCtrl.GetStringSelection().strip()
+		kindIndex = self.kindCtrl.GetSelection()
+		if kindIndex > 0:
+			prefix = self._RULE_KINDS[kindIndex][1]
+			value = prefix + self.conditionCtrl.GetValue().strip()
+		else:
+			value = self.valCtrl.GetStringSelection().strip()
+		return self.attrCtrl.GetValue().strip(), value + self._getMark()
+
+	def _getMark(self):
+		dots = self._DOT_PATTERNS[max(self.dotsCtrl.GetSelection(), 0)]
+		priority = self.priorityCtrl.GetValue()
+		if not dots and not priority:
+			return ""
+		return _MARK_PREFIX + (dots or "78") + ("/%d" % priority if priority else "")
 
 
 class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
@@ -211,10 +1744,23 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 			# wx.CheckBox does not implement SetClientData in wxPython.
 			# Store the NVDA format-field name directly on the control instead.
 			checkBox._attribraAttrName = attrName
+			checkBox._attribraLabel = checkBox.GetLabel()
 			checkBox.Bind(wx.EVT_CHECKBOX, self._onAttributeToggled)
 			attributesSizer.Add(checkBox, 0, wx.ALL, guiHelper.BORDER_FOR_DIALOGS)
 		sHelper.addItem(attributesSizer)
 
+		# Translators: Checkbox label in Attribra settings. When checked, formatting is only marked on the cells currently shown on the braille display.
+		self.windowMarkingCheckBox = sHelper.addItem(wx.CheckBox(self, label=_("Only mark the text visible on the braille display")))
+		self.windowMarkingCheckBox.SetValue(_isWindowMarking())
+		# Translators: Checkbox label in Attribra settings. When checked, formatting fetched for a line is reused while the cursor moves within it.
+		self.cacheFormattingCheckBox = sHelper.addItem(wx.CheckBox(self, label=_("Reuse formatting while moving within a line")))
+		self.cacheFormattingCheckBox.SetValue(_isCachingFormatting())
+		# Translators: Checkbox label in Attribra settings. When checked, the formatting of the lines around the cursor is fetched while the user reads.
+		self.prefetchLinesCheckBox = sHelper.addItem(wx.CheckBox(self, label=_("Prepare the formatting of the next and previous line")))
+		self.prefetchLinesCheckBox.SetValue(_isPrefetchingLines())
+		self.prefetchLinesCheckBox.Bind(wx.EVT_CHECKBOX, self._onPrefetchLinesToggled)
+		self._updateCacheFormattingCheckBox()
+
 		# Translators: Label for advanced Attribra rules not represented by the standard checkboxes.
 		self.rulesList = sHelper.addLabeledControl(_("Advanced rules"), wx.ListBox)
 		self.rulesList.Bind(wx.EVT_LISTBOX_DCLICK, self._onEdit)
@@ -239,6 +1785,17 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 
 		self._refreshSections()
 
+	def _onPrefetchLinesToggled(self, evt):
+		self._updateCacheFormattingCheckBox()
+
+	def _updateCacheFormattingCheckBox(self):
+		# Prepared lines are reused within a line like the caret line (see _refreshOptions).
+		if self.prefetchLinesCheckBox.IsChecked():
+			self.cacheFormattingCheckBox.SetValue(True)
+			self.cacheFormattingCheckBox.Disable()
+		else:
+			self.cacheFormattingCheckBox.Enable()
+
 	def postInit(self):
 		"""Place keyboard focus on the application selector."""
 		self.sectionChoice.SetFocus()
@@ -322,13 +1879,27 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 		self.Freeze()
 		try:
 			section = self._currentSection()
-			mapping = (self.plugin.configs.get(section) if self.plugin else None) or {}
+			configs = self.plugin.configs if self.plugin else {}
+			mapping = configs.get(section) or {}
+			# Global rules that apply to this application too, shown as they will be rendered.
+			inherited = _inheritedRules(configs, section)
+			# Translators: Added to an Attribra rule or checkbox in an application section when the rule comes from the global section.
+			inheritedText = _("(inherited)")
 			for attrName, checkBox in self.attributeCheckboxes.items():
-				checkBox.SetValue(attrName in mapping and True in mapping[attrName])
+				vals = mapping.get(attrName)
+				isInherited = vals is None and attrName in inherited
+				if isInherited:
+					vals = inherited[attrName]
+				checked = vals is not None and True in vals
+				checkBox.SetValue(checked)
+				label = checkBox._attribraLabel
+				checkBox.SetLabel(f"{label} {inheritedText}" if isInherited and checked else label)
 			advancedItems = []
-			for attr, vals in sorted(mapping.items(), key=lambda item: item[0].lower()):
-				if attr not in self.attributeCheckboxes:
-					advancedItems.append(f"{attr} = {_list_to_ini_value(vals)}")
+			for rules, suffix in ((mapping, ""), (inherited, " " + inheritedText)):
+				for attr, vals in sorted(rules.items(), key=lambda item: item[0].lower()):
+					# Standard attributes are listed here too when they have their own dot pattern.
+					if attr not in self.attributeCheckboxes or _splitMark(vals)[1] != _DEFAULT_MARK:
+						advancedItems.append(f"{attr} = {_list_to_ini_value(vals)}{suffix}")
 			self.rulesList.SetItems(advancedItems)
 			if advancedItems:
 				self.rulesList.SetSelection(0)
@@ -352,20 +1923,34 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 			return
 		section = self._currentSection()
 		self._ensureSectionExists(section)
+		mapping = self.plugin.configs[section]
+		mapping.pop(attrName, None)
+		# In an application section, an active global rule is inherited unless switched off here.
+		globalVals = None if section == "global" else self.plugin.configs.get("global", {}).get(attrName)
+		globalOn = globalVals is not None and not _isOffRule(globalVals) and True in globalVals
 		if checkBox.IsChecked():
-			self.plugin.configs[section][attrName] = _parse_value_to_list("1")
-		else:
-			self.plugin.configs[section].pop(attrName, None)
+			if not globalOn:
+				mapping[attrName] = _parse_value_to_list("1")
+		elif globalOn:
+			mapping[attrName] = _parse_value_to_list(_OFF_VALUE)
+		# Updates the inherited marker, and the advanced rules if the attribute was listed there.
+		self._refreshControls()
 
 	def _selectedAttr(self):
 		section = self._currentSection()
-		mapping = (self.plugin.configs.get(section) if self.plugin else None) or {}
+		configs = self.plugin.configs if self.plugin else {}
+		mapping = configs.get(section) or {}
 		sel = self.rulesList.GetSelection()
 		if sel == wx.NOT_FOUND:
 			return None, None
 		line = self.rulesList.GetString(sel)
 		attr = line.split("=", 1)[0].strip() if "=" in line else ""
-		return (attr, mapping.get(attr)) if attr else (None, None)
+		if not attr:
+			return None, None
+		if attr in mapping:
+			return attr, mapping[attr]
+		# An inherited global rule; editing it adds an override to this section.
+		return attr, _inheritedRules(configs, section).get(attr)
 
 	def _onAdd(self, evt):
 		if not self.plugin:
@@ -402,6 +1987,7 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 					# Translators: Message spoken when the attribute name field is empty.
 					ui.message(_("Missing attribute name."))
 					return
+				self._ensureSectionExists(section)
 				if newAttr != attr:
 					self.plugin.configs[section].pop(attr, None)
 				self.plugin.configs[section][newAttr] = _parse_value_to_list(valsText)
@@ -414,14 +2000,23 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 			return
 		section = self._currentSection()
 		attr, _vals = self._selectedAttr()
-		if attr:
-			self.plugin.configs.get(section, {}).pop(attr, None)
-			self._refreshControls()
+		if not attr:
+			return
+		mapping = self.plugin.configs.get(section, {})
+		if attr in mapping:
+			# An inherited global rule, if any, applies again.
+			mapping.pop(attr)
+		else:
+			# Deleting an inherited rule switches it off for this application.
+			self._ensureSectionExists(section)
+			self.plugin.configs[section][attr] = _parse_value_to_list(_OFF_VALUE)
+		self._refreshControls()
 
 	def _onReload(self, evt):
 		if not self.plugin:
 			return
 		self.plugin.parsecfgs()
+		self.plugin.applyRules()
 		self._refreshSections()
 		# Translators: Message spoken after reloading Attribra settings from disk.
 		ui.message(_("Attribra settings reloaded."))
@@ -430,13 +2025,15 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 		if not self.plugin:
 			return
 		try:
+			config.conf[CONF_SECTION]["windowMarking"] = self.windowMarkingCheckBox.IsChecked()
+			config.conf[CONF_SECTION]["cacheFormatting"] = self.cacheFormattingCheckBox.IsChecked()
+			config.conf[CONF_SECTION]["prefetchLines"] = self.prefetchLinesCheckBox.IsChecked()
+			_refreshOptions()
 			self.plugin.savecfgs()
 			try:
-				obj = api.getFocusObject()
-				if obj:
-					self.plugin.populateAttrs(obj.processID)
+				self.plugin.applyRules()
 			except Exception:
-				pass
+				log.exception("Error applying Attribra settings")
 			# Translators: Message spoken after saving Attribra settings.
 			ui.message(_("Attribra settings saved."))
 		except Exception:
@@ -452,7 +2049,16 @@ class AttribraSettingsDialog(settingsDialogs.SettingsDialog):
 
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 	configs = {}
+	# Frozen merged rule profile per section; see _compileProfiles.
+	compiledRules = {"global": _EMPTY_RULES}
 	currentPid = ""
+	_configWatcher = None
+	_settingsDialogOpen = False
+	# (configs, profiles) reloaded from disk while the settings dialog was open.
+	_pendingReload = None
+	_saveGeneration = 0
+	# The most recent background write of attribra.ini, joined on terminate.
+	_saveThread = None
 
 	def __init__(self):
 		# Translators: This add-on stores its configuration in an INI file located in the add-on folder.
@@ -460,16 +2066,26 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		addon = getCodeAddon()
 		# Use the installed add-on path rather than a hard-coded folder name.
 		self.configFile = os.path.join(addon.path, "attribra.ini")
+		# Maps process IDs to (app module, app name, compiled rules).
+		self._processCache = _LRUCache(32)
+		# Serializes background writes of attribra.ini.
+		self._saveLock = threading.Lock()
 
 		self.parsecfgs()  # parse configuration
-
+		# Pick up changes to attribra.ini made outside the settings dialog.
+		self._configWatcher = _ConfigWatcher(self.configFile, self._onConfigFileChanged)
+		self._configWatcher.start()
 
 		# Patch NVDA braille rendering hooks.
 		# We patch unconditionally so changes take effect immediately after rules are created.
 		# When no rules are configured, the patched hooks behave like NVDA defaults.
 		self._patchBrailleHooks()
+		_refreshOptions()
 
 		super().__init__()
+		braille.pre_writeCells.register(self._onPreWriteCells)
+		config.post_configProfileSwitch.register(_refreshOptions)
+		inputCore.decide_executeGesture.register(_onExecuteGesture)
 
 		# Add an Attribra button to NVDA's existing Braille category.
 		# Attribra deliberately does not register a separate settings category.
@@ -527,7 +2143,14 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			# Translators: Message spoken when the Attribra settings dialog could not be opened.
 			ui.message(_("Could not open Attribra settings."))
 			return
-		dlg.ShowModal()
+		self._settingsDialogOpen = True
+		try:
+			dlg.ShowModal()
+		finally:
+			self._settingsDialogOpen = False
+		pending = self._pendingReload
+		if pending is not None:
+			self._onConfigFileChanged(*pending)
 
 	def _patchBrailleHooks(self):
 		"""Monkeypatch NVDA's braille TextInfoRegion to support Attribra rules.
@@ -584,57 +2207,231 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 
 
 	def terminate(self):
+		for extPoint, handler in (
+			(braille.pre_writeCells, self._onPreWriteCells),
+			(config.post_configProfileSwitch, _refreshOptions),
+			(inputCore.decide_executeGesture, _onExecuteGesture),
+		):
+			try:
+				extPoint.unregister(handler)
+			except Exception:
+				pass
+		_regionMasks.clear()
+		_linePrefetcher.cancel()
+		_fieldCache.clear()
+		if self._saveThread:
+			# Don't let NVDA exit or reload plugins halfway through writing attribra.ini.
+			self._saveThread.join()
+			self._saveThread = None
+		if self._configWatcher:
+			self._configWatcher.stop()
+			self._configWatcher = None
 		self._unpatchBrailleSettingsPanel()
 		self._unpatchBrailleHooks()
 		AttribraSettingsDialog._attribraPlugin = None
 		super().terminate()
 
+	def _onPreWriteCells(self, cells, rawText, currentCellCount):
+		"""Add the Attribra dots to the cells of the display window in window marking mode.
+
+		Only the regions overlapping the window are looked at, and for each display row
+		only the cells shown are marked, so the cost is bounded by the display size
+		rather than the region length.
+		"""
+		if not _windowMarking or not _regionMasks:
+			return
+		buf = braille.handler.buffer
+		windowStart = buf.windowStartPos
+		windowEnd = buf.windowEndPos
+		# Multi-line displays show one contiguous buffer range per row.
+		rows = getattr(buf, "_windowRowBufferOffsets", None) or ((windowStart, windowEnd),)
+		cellCount = len(cells)
+		for region, start, end in buf.regionsWithPositions:
+			if end <= windowStart:
+				continue
+			if start >= windowEnd:
+				break
+			entry = _regionMasks.get(region)
+			if entry is None or entry.mask is not None:
+				continue
+			rawToBraillePos = entry.rawToBraillePos
+			regionCells = entry.digest[1]
+			for rowStart, rowEnd in rows:
+				# The region's cells shown on this row, as positions in the region.
+				first = max(start, rowStart) - start
+				last = min(end, rowEnd, start + regionCells) - start
+				if first >= last:
+					continue
+				# The raw range whose braille covers those cells; positions never decrease.
+				rawStart = max(bisect.bisect_right(rawToBraillePos, first) - 1, 0)
+				rawEnd = bisect.bisect_left(rawToBraillePos, last)
+				classes = _spansToMask(entry.spans, rawToBraillePos, regionCells, rawStart, rawEnd)
+				maskStart = rawToBraillePos[rawStart] if rawStart < len(rawToBraillePos) else regionCells
+				mask = classes[first - maskStart:last - maskStart].translate(entry.dotTable)
+				# Within a row, window positions follow buffer positions one to one.
+				try:
+					windowPos = buf.bufferPosToWindowPos(start + first)
+				except LookupError:
+					continue
+				windowEndPos = min(windowPos + len(mask), cellCount)
+				if windowPos < windowEndPos:
+					rowCells = cells[windowPos:windowEndPos]
+					_orMaskIntoCells(rowCells, mask)
+					cells[windowPos:windowEndPos] = rowCells
+
 	def event_gainFocus(self, obj, nextHandler):
+		_fieldCache.clear()
+		_linePrefetcher.cancel()
 		nextHandler()
 		pid = obj.processID
 		if self.currentPid != pid:
 			self.populateAttrs(pid)
 			self.currentPid = pid
 
+	def event_textChange(self, obj, nextHandler):
+		_fieldCache.clear()
+		nextHandler()
+
+	def event_typedCharacter(self, obj, nextHandler, ch):
+		_fieldCache.clear()
+		nextHandler()
+
+	def event_valueChange(self, obj, nextHandler):
+		_fieldCache.clear()
+		nextHandler()
+
 	def populateAttrs(self, pid):
-		if len(self.configs) == 0:
-			return
 		global ATTRS  # We are changing the global variable
+		_clearTypeformCache()
+		ATTRS = self._rulesForProcess(pid)
+
+	def _rulesForProcess(self, pid):
+		"""Return the compiled rules for a process, resolving its app name at most once.
+
+		Entries are tied to the app module NVDA has loaded for the process.
+		Once the process exits or its app module is reloaded, the entry no longer
+		matches appModuleHandler.runningTable and is resolved again.
+		"""
+		appModule = appModuleHandler.runningTable.get(pid)
+		if appModule is not None:
+			entry = self._processCache.get(pid, isValid=lambda entry: entry[0] is appModule)
+			if entry is not None:
+				return entry[2]
 		appname = appModuleHandler.getAppNameFromProcessID(pid)
-		if appname in self.configs:
-			ATTRS = self.configs[appname]
-		elif "global" in self.configs:
-			ATTRS = self.configs["global"]
-		else:
-			ATTRS = {}
+		profiles = self.compiledRules
+		rules = profiles.get(appname, profiles["global"])
+		if appModule is not None:
+			self._processCache.put(pid, (appModule, appname, rules))
+		return rules
 
 	def parsecfgs(self):
-		self.configs = {}
+		if self._configWatcher:
+			self._configWatcher.markCurrent()
+		# Unless attribra.ini changed since it was last parsed, use the compiled rule cache.
+		cached = _loadRuleCache(self.configFile)
+		if cached:
+			self._publishRules(*cached)
+			return
+		configs = {}
+		source = None
 		try:
-			config = ConfigObj(self.configFile, encoding="UTF-8")
-			for app, mapping in config.items():
-				mappings = {}
-				for name, value in mapping.items():
-					mappings[name] = _parse_value_to_list(value)
-				self.configs[app] = mappings
+			configs, source = _readConfigFile(self.configFile)
 		except IOError:
 			log.debugWarning("No attribra.ini found")
 		except Exception:
 			log.exception("Error reading attribra.ini")
+		profiles = _compileProfiles(configs)
+		if configs:
+			_saveRuleCache(self.configFile, source, configs, profiles)
+		self._publishRules(configs, profiles)
+
+	def _publishRules(self, configs, profiles):
+		"""Make newly loaded rules current. Must run on the main thread."""
+		self.configs = configs
+		# Anything reloaded while the settings dialog was open is older than these rules.
+		self._pendingReload = None
+		# Compile each section once; rendering only ever sees these immutable profiles.
+		# Publishing them is a single reference swap.
+		self.compiledRules = profiles
+		# Cached rules per process refer to the previous compilation.
+		self._processCache.clear()
+
+	def _onConfigFileChanged(self, configs, profiles):
+		"""Apply rules reloaded by the config watcher."""
+		if not self._configWatcher:
+			# The plugin was terminated while the reload was queued.
+			return
+		if self._settingsDialogOpen:
+			# Do not replace rules the user may be editing; applied once the dialog is closed.
+			self._pendingReload = (configs, profiles)
+			return
+		self._publishRules(configs, profiles)
+		self.applyRules()
+
+	def applyRules(self):
+		"""Activate the published rules for the focused application.
+
+		Braille regions are refreshed only when the effective rules actually changed.
+		"""
+		oldRules = ATTRS
+		obj = api.getFocusObject()
+		pid = obj.processID if obj else self.currentPid
+		if not pid:
+			return
+		self.populateAttrs(pid)
+		if ATTRS.rules != oldRules.rules:
+			_refreshMarkedRegions()
 
 	def savecfgs(self):
-		# Write current configs to attribra.ini
+		"""Publish the edited rules at once and write attribra.ini on a background thread."""
+		# Normalize in memory exactly as a re-read of the written file would.
+		configs = {
+			section: {attr: _parse_value_to_list(_list_to_ini_value(vals)) for attr, vals in mapping.items()}
+			for section, mapping in self.configs.items()
+		}
 		cfg = ConfigObj(encoding="UTF-8")
-		cfg.filename = self.configFile
-		for section, mapping in self.configs.items():
-			cfg.setdefault(section, {})
-			for attr, vals in mapping.items():
-				cfg[section][attr] = _list_to_ini_value(vals)
-		# Ensure directory exists
-		os.makedirs(os.path.dirname(self.configFile), exist_ok=True)
-		cfg.write()
-		# Reparse so internal types are normalized (ints, RGB parsing, etc.)
-		self.parsecfgs()
+		for section, mapping in configs.items():
+			cfg[section] = {attr: _list_to_ini_value(vals) for attr, vals in mapping.items()}
+		output = io.BytesIO()
+		cfg.write(output)
+		profiles = _compileProfiles(configs)
+		self._publishRules(configs, profiles)
+		self._saveGeneration += 1
+		# Earlier writes either finish before this one takes the lock or are skipped as stale,
+		# so waiting for the newest thread waits for them all.
+		self._saveThread = threading.Thread(
+			target=self._writeConfigFile,
+			args=(self._saveGeneration, output.getvalue(), configs, profiles),
+			name="AttribraSave",
+			daemon=True,
+		)
+		self._saveThread.start()
+
+	def _writeConfigFile(self, generation, content, configs, profiles):
+		"""Atomically replace attribra.ini with content. Runs on a background thread."""
+		with self._saveLock:
+			if generation != self._saveGeneration:
+				# A newer save is waiting for the lock; it supersedes this one.
+				return
+			tempPath = self.configFile + ".tmp"
+			try:
+				os.makedirs(os.path.dirname(self.configFile), exist_ok=True)
+				with open(tempPath, "wb") as f:
+					f.write(content)
+					f.flush()
+					os.fsync(f.fileno())
+				# A crash before this point leaves the previous attribra.ini intact.
+				os.replace(tempPath, self.configFile)
+				signature = _fileSignature(self.configFile)
+			except OSError:
+				log.exception("Error writing attribra.ini")
+				# Translators: Message spoken when saving Attribra settings failed.
+				wx.CallAfter(ui.message, _("Save failed; see log for details."))
+				return
+			if self._configWatcher:
+				self._configWatcher.markCurrent()
+			_saveRuleCache(self.configFile, (signature, content), configs, profiles)
+
 	def script_editConfig(self, gesture):
 		try:
 			gui.mainFrame.onNVDASettingsCommand(None)
@@ -647,14 +2444,51 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 				log.exception("Could not open settings or ini file")
 
 	def script_logFieldsAtCursor(self, gesture):
-		global logTextInfo
-		logTextInfo = not logTextInfo
-		# Translators: Message spoken when toggling debug logging of TextInfo at the cursor. {state} is "start" or "stop".
+		_fieldTrace.enabled = not _fieldTrace.enabled
+		if _fieldTrace.enabled:
+			_fieldTrace.clear()
 		# Translators: The state toggled by the "log fields at cursor" command.
-		state = _("start") if logTextInfo else _("stop")
-		ui.message(_("Debug TextInfo logging: {state}").format(state=state))
+		state = _("start") if _fieldTrace.enabled else _("stop")
+		# Translators: Message spoken when toggling tracing of the formatting seen by Attribra. {state} is "start" or "stop".
+		ui.message(_("Attribra field tracing: {state}").format(state=state))
+		log.info("Attribra typeform cache: %s" % _typeformCache.stats())
+		log.info("Attribra process cache: %s" % self._processCache.stats())
+		log.info("Attribra format field cache: %s" % _fieldCache.stats())
+		log.info("Attribra field trace: %d records, %d dropped by the rate limit" % (len(_fieldTrace), _fieldTrace.dropped))
+
+	def script_dumpFieldTrace(self, gesture):
+		if not len(_fieldTrace):
+			# Translators: Message spoken when there is no Attribra field trace to save.
+			ui.message(_("No Attribra trace recorded; start tracing first."))
+			return
+		path = os.path.join(globalVars.appArgs.configPath, "attribra-trace.jsonl")
+		# The records are taken here, as the trace keeps changing on the main thread.
+		threading.Thread(
+			target=self._writeFieldTrace,
+			args=(path, _fieldTrace.snapshot()),
+			name="AttribraTraceDump",
+			daemon=True,
+		).start()
+
+	def _writeFieldTrace(self, path, records):
+		"""Write trace records to path as JSON lines. Runs on a background thread."""
+		try:
+			with open(path, "w", encoding="utf-8") as f:
+				for record in records:
+					f.write(json.dumps(record, ensure_ascii=False))
+					f.write("\n")
+		except OSError:
+			log.exception("Error writing the Attribra field trace")
+			# Translators: Message spoken when the Attribra field trace could not be saved.
+			wx.CallAfter(ui.message, _("Could not save the Attribra trace; see log for details."))
+			return
+		count = len(records)
+		log.info("Attribra: wrote %d trace records to %s" % (count, path))
+		# Translators: Message spoken after saving the Attribra field trace. {count} is the number of records, {path} the file.
+		wx.CallAfter(ui.message, _("Saved {count} trace records to {path}").format(count=count, path=path))
 
 	__gestures = {
 		"kb:NVDA+control+a": "editConfig",
 		"kb:NVDA+control+shift+a": "logFieldsAtCursor",
+		"kb:NVDA+control+alt+a": "dumpFieldTrace",
 	}
@@ -32,6 +32,8 @@ def _logAddonLoaded():
         log.info("BrailleSelection add-on loaded")
 
 
+import weakref
+
 import braille
 import api
 import config
@@ -66,6 +68,16 @@ def _isEnabled():
 
 def _setEnabled(value):
     config.conf[CONF_SECTION]["enabled"] = bool(value)
+    _refreshSettings()
+
+# Snapshot of _isEnabled(). Reading config.conf goes through NVDA's profile layers,
+# which is too slow to do on every display write while marking is off.
+_enabled = False
+
+def _refreshSettings():
+    """Take a new snapshot of the enabled setting; called on profile switches, saves and toggles."""
+    global _enabled
+    _enabled = _isEnabled()
 
 def _announceEnabledState(enabled):
         # Translators: Message reported when braille selection marking has been enabled.
@@ -132,15 +144,32 @@ def _unpatchBrailleSettingsPanel():
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
     def __init__(self):
         super().__init__()
+        # id(region.obj) -> (region, start) for the regions of the main buffer,
+        # valid as long as the buffer's brailleCells list is the one it was built for.
+        self._regionIndex = {}
+        self._indexedCells = None
+        # region -> (rawText, rawToBraillePos, name, braille span of the name in the region)
+        self._nameSpans = weakref.WeakKeyDictionary()
+        # The focus object with its SELECTED state and name, kept up to date by events,
+        # so display writes need no out-of-process queries.
+        self._focusObj = None
+        self._focusSelected = False
+        self._focusName = ""
         _patchBrailleSettingsPanel()
+        _refreshSettings()
+        config.post_configProfileSwitch.register(_refreshSettings)
         braille.pre_writeCells.register(self._onPreWriteCells)
         _logAddonLoaded()
 
     def terminate(self):
-        try:
-            braille.pre_writeCells.unregister(self._onPreWriteCells)
-        except Exception:
-            pass
+        for extPoint, handler in (
+            (braille.pre_writeCells, self._onPreWriteCells),
+            (config.post_configProfileSwitch, _refreshSettings),
+        ):
+            try:
+                extPoint.unregister(handler)
+            except Exception:
+                pass
         _unpatchBrailleSettingsPanel()
         super().terminate()
 
@@ -156,11 +185,46 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
         _setEnabled(newVal)
         _announceEnabledState(newVal)
 
+    # The cached state is refreshed before nextHandler(), as NVDA updates braille further down the chain.
+    def event_gainFocus(self, obj, nextHandler):
+        self._trackFocus(obj)
+        nextHandler()
+
+    def event_stateChange(self, obj, nextHandler):
+        if obj is self._focusObj:
+            self._refreshFocusState()
+        nextHandler()
+
+    def event_selection(self, obj, nextHandler):
+        if obj is self._focusObj:
+            self._refreshFocusState()
+        nextHandler()
+
+    def event_nameChange(self, obj, nextHandler):
+        if obj is self._focusObj:
+            self._refreshFocusState()
+        nextHandler()
+
+    def _trackFocus(self, obj):
+        self._focusObj = obj
+        self._refreshFocusState()
+
+    def _refreshFocusState(self):
+        obj = self._focusObj
+        try:
+            self._focusSelected = bool(obj) and controlTypes.State.SELECTED in obj.states
+            self._focusName = (obj.name or "").strip() if self._focusSelected else ""
+        except Exception:
+            log.debugWarning("Could not read the state of the focus object", exc_info=True)
+            self._focusSelected = False
+            self._focusName = ""
+
     def _onPreWriteCells(self, cells, rawText, currentCellCount):
-        if not _isEnabled():
+        if not _enabled:
             return
 
-
+        # Braille mode and tether change with NVDA's own commands (and tether "auto" follows
+        # the review cursor) without any notification, so they are checked on every write.
         if config.conf["braille"]["mode"] != BrailleMode.FOLLOW_CURSORS.value:
             return
         if braille.handler.getTether() != TetherTo.FOCUS.value:
@@ -169,49 +233,87 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
             return
 
         focusObj = api.getFocusObject()
-        if not focusObj or controlTypes.State.SELECTED not in focusObj.states:
+        if focusObj is not self._focusObj:
+            # The focus changed without a gainFocus event reaching this plugin.
+            self._trackFocus(focusObj)
+        if not focusObj or not self._focusSelected:
             return
 
         buf = braille.handler.mainBuffer
 
         # 1) Vind de region die bij het focus-object hoort
-        targetRegion = None
-        targetRegionStart = None
-        for region, start, end in buf.regionsWithPositions:
-            if getattr(region, "obj", None) is focusObj:
-                targetRegion = region
-                targetRegionStart = start
-                break
+        targetRegion, targetRegionStart = self._findRegion(buf, focusObj)
         if not targetRegion:
             return
 
         # 2) Itemtekst
-        name = (focusObj.name or "").strip()
+        name = self._focusName
         if not name:
             return
 
-        raw = targetRegion.rawText or ""
-        rawStart = raw.find(name)
-        if rawStart < 0:
-            return
-        rawEnd = rawStart + len(name)
-
         # 3) raw -> braille mapping
-        r2b = targetRegion.rawToBraillePos
-        if not r2b or (rawEnd - 1) >= len(r2b):
+        span = self._nameSpan(targetRegion, name)
+        if not span:
             return
-
-        brailleStartInRegion = r2b[rawStart]
-        brailleEndInRegion = r2b[rawEnd - 1] + 1  # exclusief
+        brailleStartInRegion, brailleEndInRegion = span
 
         # 4) Regionposities -> windowposities
         bufferStart = targetRegionStart + brailleStartInRegion
         bufferEnd = targetRegionStart + brailleEndInRegion
 
-        for bufferPos in range(bufferStart, bufferEnd):
+        # Multi-line displays show one contiguous buffer range per row.
+        rows = getattr(buf, "_windowRowBufferOffsets", None) or ((buf.windowStartPos, buf.windowEndPos),)
+        for rowStart, rowEnd in rows:
+            start = max(bufferStart, rowStart)
+            end = min(bufferEnd, rowEnd)
+            if start >= end:
+                continue
+            # Within a row, window positions follow buffer positions one to one.
             try:
-                windowPos = buf.bufferPosToWindowPos(bufferPos)
+                windowStart = buf.bufferPosToWindowPos(start)
             except LookupError:
                 continue
-            if 0 <= windowPos < len(cells):
-                cells[windowPos] |= SELECTION_SHAPE
+            windowEnd = min(windowStart + end - start, len(cells))
+            if windowStart < windowEnd:
+                cells[windowStart:windowEnd] = [cell | SELECTION_SHAPE for cell in cells[windowStart:windowEnd]]
+
+    def _findRegion(self, buf, obj):
+        """Return (region, start) of the first region of buf showing obj, or (None, None).
+
+        BrailleBuffer.update() builds a new brailleCells list whenever regions or their
+        positions change, so the index is only rebuilt when that list has been replaced.
+        """
+        if buf.brailleCells is not self._indexedCells:
+            index = {}
+            for region, start, end in buf.regionsWithPositions:
+                regionObj = getattr(region, "obj", None)
+                if regionObj is not None:
+                    index.setdefault(id(regionObj), (region, start))
+            self._regionIndex = index
+            self._indexedCells = buf.brailleCells
+        region, start = self._regionIndex.get(id(obj), (None, None))
+        # id() values can be reused once an object is gone; make sure it is the same object.
+        if region is None or region.obj is not obj:
+            return None, None
+        return region, start
+
+    def _nameSpan(self, region, name):
+        """Return (start, end) of name in the braille of region, end exclusive, or None.
+
+        The span only depends on the region's raw text, its raw to braille mapping and the name.
+        Region.update() replaces rawText and rawToBraillePos, so while the user pans
+        or the cursor blinks the cached span is returned without searching or mapping again.
+        """
+        raw = region.rawText or ""
+        r2b = region.rawToBraillePos
+        entry = self._nameSpans.get(region)
+        if entry is not None and entry[0] is raw and entry[1] is r2b and entry[2] == name:
+            return entry[3]
+        span = None
+        rawStart = raw.find(name)
+        if rawStart >= 0:
+            rawEnd = rawStart + len(name)
+            if r2b and (rawEnd - 1) < len(r2b):
+                span = (r2b[rawStart], r2b[rawEnd - 1] + 1)  # exclusief
+        self._nameSpans[region] = (raw, r2b, name, span)
+        return span